@@ -1,22 +1,51 @@
 # nz_energy_dashboard.py
-# Run: pip install pandas requests beautifulsoup4 streamlit plotly
+# Run: pip install pandas pyarrow requests beautifulsoup4 lxml streamlit plotly
+# Optional: pip install numba (compiled TP row sums)
 # Then: streamlit run nz_energy_dashboard.py
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+import csv
+import hashlib
 import io
+import os
+import pathlib
+import re
+import time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import streamlit as st
 import plotly.express as px
+try:
+    import numba  # optional: compiled row sums over the TP block
+except ImportError:
+    numba = None
 from datetime import timedelta
 
 # 1) Find the latest Generation_MD CSV on EMI site
 EMI_GEN_PAGE = "https://www.emi.ea.govt.nz/Wholesale/Datasets/Generation/Generation_MD"
 
+# EMI only publishes new Generation_MD files monthly, so an hour is plenty
+CACHE_TTL_SECONDS = 3600
+
+# One pooled session per server process so the page lookup and CSV download reuse keep-alive sockets
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
 def find_latest_generation_csv(page_url=EMI_GEN_PAGE):
-    r = requests.get(page_url, timeout=15)
+    r = get_http_session().get(page_url, timeout=15)
     r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+    # C-backed lxml parser, and only build <a href> tags - the rest of the page is never used
+    soup = BeautifulSoup(r.text, "lxml", parse_only=SoupStrainer("a", href=True))
     # look for links ending with '_Generation_MD.csv'
     csv_links = []
     for a in soup.find_all("a", href=True):
@@ -31,13 +60,133 @@ def find_latest_generation_csv(page_url=EMI_GEN_PAGE):
     return csv_links[0] if csv_links else None
 
 # 2) Download CSV into a DataFrame
+# Generation_MD has one column per half-hour trading period (TP49/TP50 only used on DST days);
+# float32 halves the bytes scanned when summing them
+TP_COLUMNS = [f'TP{i}' for i in range(1, 51)]
+TP_DTYPES = {c: pa.float32() for c in TP_COLUMNS}
+GENERATION_COLUMNS = ['Generation_MWh','Generation_kWh','Generation','GENERATION','Generation_MW','GEN_MW']
+CODE_COLUMNS = ['Fuel_Code','Gen_Code','Site_Code','Nwk_Code','Tech_Code']
+# only these columns are used downstream (POC_Code, Island, Trader etc. are never read)
+NEEDED_COLUMNS = {c.upper() for c in ['Trading_date','Trading_period'] + CODE_COLUMNS + TP_COLUMNS + GENERATION_COLUMNS}
+# explicit types (keyed by upper-cased name) so pyarrow skips type inference; codes arrive as categories.
+# Trading_date is left to pyarrow, which parses ISO dates natively.
+COLUMN_TYPES = {
+    'TRADING_PERIOD': pa.int16(),
+    **{c.upper(): pa.dictionary(pa.int32(), pa.string()) for c in CODE_COLUMNS},
+    **{c.upper(): pa.float32() for c in TP_COLUMNS},
+}
+
+class ResponseStream(io.RawIOBase):
+    # file-like view over streamed response chunks; wrapping r.raw directly in a
+    # BufferedReader fails at EOF because urllib3 reports the body as closed
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            self._pending = memoryview(next(self._chunks, b""))
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def convert_options_for(stream):
+    # peek the header without consuming it so columns can be projected and typed by their real names
+    first_chunk = stream.peek(1 << 16)
+    if b"\n" not in first_chunk:
+        # header not in the first chunk: read every column, typing the TP block only
+        return pacsv.ConvertOptions(column_types=TP_DTYPES)
+    header_line = first_chunk.split(b"\n", 1)[0].decode("utf-8-sig")
+    header = next(csv.reader([header_line]))
+    usecols = [c for c in header if c.strip().upper() in NEEDED_COLUMNS]
+    column_types = {c: COLUMN_TYPES[c.strip().upper()] for c in header if c.strip().upper() in COLUMN_TYPES}
+    return pacsv.ConvertOptions(column_types=column_types, include_columns=usecols or None)
+
+def normalise_code_columns(df):
+    # strip/upper-case each code column once at ingest and keep it as a category;
+    # mapping a categorical only touches its few distinct labels, not every row
+    code_names = {c.upper() for c in CODE_COLUMNS}
+    for c in df.columns:
+        if c.strip().upper() in code_names:
+            labels = df[c].astype('category')
+            df[c] = labels.map(lambda v: str(v).strip().upper(), na_action='ignore').astype('category')
+    return df
+
 def download_generation_csv(csv_url):
-    r = requests.get(csv_url, timeout=30)
-    r.raise_for_status()
-    # some EMI CSVs contain odd encodings; pandas can usually parse from bytes
-    df = pd.read_csv(io.BytesIO(r.content), low_memory=False)
+    with get_http_session().get(csv_url, timeout=30, stream=True) as r:
+        r.raise_for_status()
+        # parse straight off the socket so download and parsing overlap;
+        # iter_content undoes the gzip transfer encoding requests negotiates by default
+        stream = io.BufferedReader(ResponseStream(r.iter_content(1 << 16)), buffer_size=1 << 16)
+        # pyarrow parses on all cores; unknown names in column_types are simply ignored
+        table = pacsv.read_csv(
+            stream,
+            read_options=pacsv.ReadOptions(use_threads=True),
+            convert_options=convert_options_for(stream),
+        )
+    # date columns come back as datetime64 rather than Python date objects
+    return normalise_code_columns(table.to_pandas(date_as_object=False))
+
+# Parquet copy of each parsed CSV, so a new session or worker restart skips the download.
+# The current month's file is republished daily, hence the age limit.
+PARQUET_CACHE_DIR = pathlib.Path(__file__).parent / ".cache"
+PARQUET_MAX_AGE = timedelta(days=1)
+
+def read_generation_csv(csv_url):
+    path = PARQUET_CACHE_DIR / f"{hashlib.md5(csv_url.encode()).hexdigest()}.parquet"
+    if path.exists() and time.time() - path.stat().st_mtime < PARQUET_MAX_AGE.total_seconds():
+        return pd.read_parquet(path)
+    df = download_generation_csv(csv_url)
+    try:
+        PARQUET_CACHE_DIR.mkdir(exist_ok=True)
+        # write then rename so a concurrent session never reads a half-written file
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # read-only checkout: still works, just without the disk cache
     return df
 
+# Row-wise total of a C-contiguous (rows x periods) float32 block, skipping blank periods.
+# No fastmath: it would let numba assume there are no NaNs to skip. No parallel=True either:
+# Streamlit runs the script off the main thread, where numba's TBB layer hangs on exit.
+if numba is not None:
+    @numba.njit(cache=True)
+    def row_sum(a):
+        out = np.empty(a.shape[0], dtype=np.float32)
+        for i in range(a.shape[0]):
+            s = np.float32(0)
+            for j in range(a.shape[1]):
+                if not np.isnan(a[i, j]):
+                    s += a[i, j]
+            out[i] = s
+        return out
+else:
+    def row_sum(a):
+        return np.nansum(a, axis=1)
+
+# Known trading-date layouts; an explicit format parses far faster than per-row inference
+DATE_FORMATS = [
+    (re.compile(r'\d{4}-\d{2}-\d{2}'), '%Y-%m-%d'),
+    (re.compile(r'\d{1,2}/\d{1,2}/\d{4}'), '%d/%m/%Y'),
+    (re.compile(r'\d{1,2}-\d{1,2}-\d{4}'), '%d-%m-%Y'),
+]
+
+def parse_dates(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    # sniff the format once from the first value instead of trying parsers over every row
+    non_null = series.dropna()
+    sample = non_null.iat[0] if not non_null.empty else None
+    fmt = None
+    if isinstance(sample, str):
+        fmt = next((f for pattern, f in DATE_FORMATS if pattern.fullmatch(sample.strip())), None)
+    return pd.to_datetime(series, format=fmt, cache=True, errors='coerce')
+
 # 3) Normalise / aggregate generation by fuel type
 def process_generation_df(df):
     # Try to find key columns by common names
@@ -45,11 +194,19 @@ def process_generation_df(df):
     possible_gen_cols = [c for c in df.columns if 'generation' in c.lower() or 'gen'==c.lower() or 'mw' in c.lower()]
     possible_fuel_cols = [c for c in df.columns if 'fuel' in c.lower() or 'fuel_type' in c.lower() or 'fueltype' in c.lower()]
 
+    # per-period files: total each row across its trading periods
+    tp_cols = [c for c in TP_COLUMNS if c in df.columns]
+    if tp_cols:
+        # pandas stores the TP block column-major, so to_numpy() hands back an F-ordered array;
+        # copy it to C order once so the row-wise sum walks contiguous memory (row_sum assumes this)
+        tp_block = np.ascontiguousarray(df[tp_cols].to_numpy(dtype=np.float32))
+        df['DAILY_GENERATION'] = row_sum(tp_block)
+
     # pick guess columns
     ts_col = possible_ts_cols[0] if possible_ts_cols else None
     fuel_col = possible_fuel_cols[0] if possible_fuel_cols else None
     gen_col = None
-    for c in ['Generation_MWh','Generation_kWh','Generation','GENERATION','Generation_MW','GEN_MW']:
+    for c in ['DAILY_GENERATION'] + GENERATION_COLUMNS:
         if c in df.columns:
             gen_col = c
             break
@@ -60,13 +217,17 @@ def process_generation_df(df):
 
     # Basic cleaning
     if ts_col:
-        df[ts_col] = pd.to_datetime(df[ts_col], errors='coerce')
+        df[ts_col] = parse_dates(df[ts_col])
     if gen_col:
         # convert to numeric
         df[gen_col] = pd.to_numeric(df[gen_col], errors='coerce').fillna(0)
+    if fuel_col:
+        # few distinct fuels: group on small int codes instead of hashing every string
+        df[fuel_col] = df[fuel_col].astype('category')
+        df['Fuel_Category'] = categorise_fuel(df[fuel_col])
     # group by fuel
     if fuel_col and gen_col:
-        agg = df.groupby(fuel_col)[gen_col].sum().reset_index()
+        agg = df.groupby(fuel_col, observed=True)[gen_col].sum().reset_index()
         agg = agg.sort_values(by=gen_col, ascending=False)
     else:
         # if missing, try grouping by Station / Plant -> map to fuel not available: sum numeric cols
@@ -75,21 +236,35 @@ def process_generation_df(df):
     # return cleaned results
     return agg, df, {'ts_col': ts_col, 'fuel_col': fuel_col, 'gen_col': gen_col}
 
+# Download + process keyed on the (hashable) CSV URL so widget reruns reuse the result
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def load_generation_data(csv_url):
+    df = read_generation_csv(csv_url)
+    return process_generation_df(df)
+
 # 4) Compute renewable share helper
 RENEWABLE_KEYWORDS = ['hydro','geo','wind','solar','biomass','battery']
+# compiled once; shared by is_renewable and the vectorised str.contains calls
+RENEWABLE_RE = re.compile('|'.join(map(re.escape, RENEWABLE_KEYWORDS)), re.IGNORECASE)
 
 def is_renewable(fuel_name):
-    if not isinstance(fuel_name, str):
-        return False
-    fn = fuel_name.lower()
-    return any(k in fn for k in RENEWABLE_KEYWORDS)
+    return isinstance(fuel_name, str) and bool(RENEWABLE_RE.search(fuel_name))
+
+def categorise_fuel(fuel):
+    # classify each distinct fuel label once, then map every row's code through the lookup
+    fuel = fuel.astype('category')
+    labels = fuel.cat.categories
+    renewable = labels.astype(str).str.contains(RENEWABLE_RE)
+    lookup = dict(zip(labels, np.where(renewable, 'Renewable', 'Non-Renewable')))
+    return fuel.map(lookup).astype('category')
 
 def compute_renewable_share(agg_df):
-    agg_df['is_renewable'] = agg_df.iloc[:,0].apply(is_renewable)
+    # vectorised equivalent of is_renewable over the whole fuel column
+    agg_df['is_renewable'] = agg_df.iloc[:,0].astype(str).str.contains(RENEWABLE_RE, na=False)
     total = agg_df.iloc[:,1].sum()
     renew = agg_df.loc[agg_df['is_renewable'], agg_df.columns[1]].sum()
     share = (renew / total)*100 if total > 0 else 0
-    return round(share,2)
+    return round(float(share),2)
 
 ############### Streamlit UI ###############
 st.set_page_config(page_title="NZ Energy Live — Electric Kiwi demo", layout="wide")
@@ -104,8 +279,7 @@ with st.spinner("Locating latest EMI Generation dataset..."):
 
 with st.spinner("Downloading & processing data..."):
     try:
-        df = download_generation_csv(csv_url)
-        agg, raw_df, meta = process_generation_df(df)
+        agg, raw_df, meta = load_generation_data(csv_url)
     except Exception as e:
         st.error(f"Error downloading or parsing CSV: {e}")
         st.stop()
@@ -135,20 +309,16 @@ else:
 # Optional: show renewable share over time if the raw data contains timestamp and fuel/time granularity.
 if meta.get('ts_col') and meta.get('fuel_col') and meta.get('gen_col'):
     ts = meta['ts_col']
-    fuel = meta['fuel_col']
     gen = meta['gen_col']
     # build time-series of renewables %
-    # pivot by timestamp and fuel
-    pivot = raw_df.pivot_table(index=ts, columns=fuel, values=gen, aggfunc='sum', fill_value=0)
-    pivot['total'] = pivot.sum(axis=1)
-    # sum renewables per timestamp
-    renew_cols = [c for c in pivot.columns if is_renewable(c)]
-    if renew_cols:
-        pivot['renew_sum'] = pivot[renew_cols].sum(axis=1)
-        pivot['renew_share_pct'] = (pivot['renew_sum'] / pivot['total'])*100
-        # trim to last 7 days (if timestamps exist)
-        last_dt = pivot.index.max()
-        last_week = pivot.loc[last_dt - pd.Timedelta(days=7):]
+    # trim to last 7 days (if timestamps exist) before aggregating, so older rows never reach the groupby
+    last_dt = raw_df[ts].max()
+    recent_df = raw_df.loc[raw_df[ts] >= last_dt - pd.Timedelta(days=7)]
+    # only the Renewable / Non-Renewable split is needed, so aggregate straight to
+    # timestamp x Fuel_Category (two columns) instead of pivoting every fuel
+    by_cat = recent_df.groupby([ts, 'Fuel_Category'], observed=True)[gen].sum().unstack(fill_value=0)
+    if 'Renewable' in by_cat.columns:
+        last_week = ((by_cat['Renewable'] / by_cat.sum(axis=1))*100).rename('renew_share_pct')
         st.subheader("Renewable share — last 7 days (%)")
         fig_line = px.line(last_week.reset_index(), x=ts, y='renew_share_pct', title="Renewable share (%) over time")
         st.plotly_chart(fig_line, use_container_width=True)
@@ -159,4 +329,4 @@ else:
 
 # Footer: show top of dataframe for inspection
 st.subheader("Preview of raw data (first 10 rows)")
-st.dataframe(df.head(10))
+st.dataframe(raw_df.head(10))